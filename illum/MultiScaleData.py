@@ -132,6 +132,11 @@ class MultiScaleData:
             d2 = (X - X0) ** 2 + (Y - Y0) ** 2
             self[i][d2 <= R**2] = value
 
+    def fill(self, value=0):
+        """Set all layers to a constant value."""
+        for layer in self._data:
+            layer.fill(value)
+
     def set_overlap(self, value=0):
         nb_core = self._attrs["nb_core"]
         for i in range(1, len(self)):
@@ -216,13 +221,13 @@ def Open(filename):
     """Open a multiscale HDF5 data fileself.
 
     Returns a MultiScaleData object."""
-    ds = _HDFile(filename, "r")
-    data = [ds["layers"][n][:] for n in sorted(ds["layers"], key=int)]
-    params = dict(ds.attrs)
-    params["layers"] = [
-        dict(ds["layers"][n].attrs) for n in sorted(ds["layers"], key=int)
-    ]
-    params.update(("obs_" + k, ds["obs"][k][:]) for k in ds["obs"])
+    with _HDFile(filename, "r") as ds:
+        data = [ds["layers"][n][:] for n in sorted(ds["layers"], key=int)]
+        params = dict(ds.attrs)
+        params["layers"] = [
+            dict(ds["layers"][n].attrs) for n in sorted(ds["layers"], key=int)
+        ]
+        params.update(("obs_" + k, ds["obs"][k][:]) for k in ds["obs"])
     try:
         params["srs"] = params["srs"].decode("utf-8")
     except AttributeError:
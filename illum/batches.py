@@ -7,37 +7,326 @@
 #
 # March 2021
 
+import multiprocessing as mp
 import os
 import shutil
-from collections import ChainMap, OrderedDict
-from functools import partial
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache, partial
 from glob import glob
-from itertools import product
+from itertools import islice, product
+from math import prod
 
 import click
 import numpy as np
 import yaml
-from progressbar import progressbar
+from progressbar import ProgressBar, progressbar
 
 import illum
 from illum import MultiScaleData as MSD
 from illum.pytools import save_bin
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
 progress = partial(progressbar, redirect_stdout=True)
 
+illumpath = os.path.dirname(illum.__path__[0])
+illumina_exe = os.path.abspath(illumpath + "/bin/illumina")
+
+
+def input_template(comments, n_space=30):
+    """Builds the %-format template of an input file.
+
+    Each line has one text field followed by its `comments`."""
+    return "\n".join(
+        "%%-%ds ! %s" % (n_space, " ; ".join(comment).replace("%", "%%"))
+        for comment in comments
+    )
+
+
+illumina_in = input_template(
+    (
+        ("Input file for ILLUMINA",),
+        ("Root file name",),
+        ("Cell size along X [m]", "Cell size along Y [m]"),
+        ("Aerosol optical cross section file",),
+        (
+            "Layer optical cross section file",
+            "Layer aerosol optical depth at 500nm",
+            "Layer angstom coefficient",
+            "Layer scale height [m]",
+        ),
+        ("Double scattering activated",),
+        ("Single scattering activated",),
+        ("Wavelength [nm]", "Bandwidth [nm]"),
+        ("Reflectance",),
+        ("Ground level pressure [kPa]",),
+        (
+            "Aerosol optical depth at 500nm",
+            "Angstrom exponent",
+            "Aerosol scale height [m]",
+        ),
+        ("Number of source types",),
+        ("Contribution threshold",),
+        ("",),
+        (
+            "Observer X position",
+            "Observer Y position",
+            "Observer elevation above ground [m]",
+        ),
+        ("Obstacles around observer",),
+        ("Elevation viewing angle", "Azimuthal viewing angle"),
+        ("Direct field of view",),
+        ("",),
+        ("",),
+        ("",),
+        ("Radius around light sources where reflextions are computed",),
+        (
+            "Cloud model: "
+            "0=clear, "
+            "1=Thin Cirrus/Cirrostratus, "
+            "2=Thick Cirrus/Cirrostratus, "
+            "3=Altostratus/Altocumulus, "
+            "4=Cumulus/Cumulonimbus, "
+            "5=Stratocumulus",
+            "Cloud base altitude [m]",
+            "Cloud fraction",
+        ),
+        ("",),
+    )
+)
+
+
+def create_symlinks(fold_name, targets):
+    """Links the (path, name) `targets` pairs into `fold_name`.
+
+    Relative paths are taken from the current directory."""
+    # Same as os.path.relpath(".", fold_name) for a normalised relative
+    # folder, without resolving the current directory
+    rel_prefix = os.sep.join([os.pardir] * (fold_name.rstrip(os.sep).count(os.sep) + 1))
+    for path, name in targets:
+        os.symlink(os.path.join(rel_prefix, path), fold_name + name)
+
+
+@lru_cache(maxsize=None)
+def link_plan(exp_name, aerosol_profile, layer_type, lamps, wavelength, layer, coords):
+    """Lists the (path, name) inputs linked in the execution folders.
+
+    The plan only depends on the wavelength, layer and observer `coords`,
+    so it is built once per folder group."""
+    # Illumina derives its input and output names from the root file name and
+    # writes its outputs in the run folder, so the inputs can't be shared
+    # through a single linked directory.
+    obs_fold = os.path.join("obs_data", coords, str(layer))
+    plan = [
+        (f"{aerosol_profile}_{wavelength}.txt", "aerosol.txt"),
+        (f"{layer_type}_{wavelength}.txt", "layer.txt"),
+        ("MolecularAbs.txt", "MolecularAbs.txt"),
+        (illumina_exe, "illumina"),
+        (os.path.join(obs_fold, "srtm.bin"), exp_name + "_topogra.bin"),
+        (os.path.join(obs_fold, "origin.bin"), "origin.bin"),
+    ]
+    for name in ["obstd", "obsth", "obstf", "altlp"]:
+        plan.append(
+            (
+                os.path.join(obs_fold, f"{exp_name}_{name}.bin"),
+                f"{exp_name}_{name}.bin",
+            )
+        )
+    for i, lamp in enumerate(lamps, 1):
+        plan.append(
+            (
+                f"fctem_wl_{wavelength}_lamp_{lamp}.dat",
+                exp_name + "_fctem_%03d.dat" % i,
+            )
+        )
+        plan.append(
+            (
+                os.path.join(obs_fold, f"{exp_name}_{wavelength}_lumlp_{lamp}.bin"),
+                "%s_lumlp_%03d.bin" % (exp_name, i),
+            )
+        )
+    return plan
+
+
+# Parameters that define a folder when similar executions are chained
+compact_keys = ("observer_coordinates", "wavelength", "layer")
+
+
+def setup_run(context, param_vals):
+    """Prepares the execution folder and input file of one parameter combination.
+
+    `context` holds the values shared by all the combinations.
+
+    Returns the folder and the unique ID of the run."""
+    params = context["params"]
+    multival = context["multival"]
+    compact = context["compact"]
+    dir_name = context["dir_name"]
+    exp_name = params["exp_name"]
+    lamps = context["lamps"]
+    multi_obs = context["multi_obs"]
+    bearings = context["bearings"]
+    reflectances = context["reflectances"]
+    bandwidths = context["bandwidths"]
+    pixel_sizes = context["pixel_sizes"]
+
+    P = params.copy()
+    P.update(zip(multival, param_vals))
+
+    bearing = bearings[P["observer_coordinates"]]
+    coords = "%6f_%6f" % P["observer_coordinates"]
+    if multi_obs:
+        P["observer_coordinates"] = coords
+
+    names = [f"{k}_{P[k]}" for k in multival]
+    unique_ID = "-".join(names)
+    if compact:
+        names = [n for k, n in zip(multival, names) if k in compact_keys]
+    fold_name = dir_name + os.sep.join(names) + os.sep
+
+    wavelength = "%g" % P["wavelength"]
+    layer = P["layer"]
+    reflectance = reflectances[P["wavelength"]]
+    bandwidth = bandwidths[P["wavelength"]]
+
+    try:
+        os.makedirs(fold_name)
+    except FileExistsError:
+        pass  # Shared folder, already created by another run
+    else:
+        plan = link_plan(
+            exp_name,
+            params["aerosol_profile"],
+            params["layer_type"],
+            lamps,
+            wavelength,
+            layer,
+            coords,
+        )
+        create_symlinks(fold_name, plan)
+
+    # Create illumina.in, following the lines of `illumina_in`
+    input_values = (
+        ("",),
+        (exp_name,),
+        (pixel_sizes[layer], pixel_sizes[layer]),
+        ("aerosol.txt",),
+        ("layer.txt", P["layer_aod"], P["layer_alpha"], P["layer_height"]),
+        (P["double_scattering"] * 1,),
+        (P["single_scattering"] * 1,),
+        (wavelength, bandwidth),
+        (reflectance,),
+        (P["air_pressure"],),
+        (
+            P["aerosol_optical_depth"],
+            P["angstrom_coefficient"],
+            P["aerosol_height"],
+        ),
+        (len(lamps),),
+        (P["stop_limit"],),
+        ("",),
+        (256, 256, P["observer_elevation"]),
+        (P["observer_obstacles"] * 1,),
+        (P["elevation_angle"], (P["azimuth_angle"] + bearing) % 360),
+        (P["direct_fov"],),
+        ("",),
+        ("",),
+        ("",),
+        (P["reflection_radius"],),
+        (P["cloud_model"], P["cloud_base"], P["cloud_fraction"]),
+        ("",),
+    )
+
+    with open(fold_name + unique_ID + ".in", "w") as f:
+        f.write(illumina_in % tuple(" ".join(map(str, v)) for v in input_values))
+
+    return fold_name, unique_ID
+
+
+# Context of the runs prepared in a pool worker
+worker_context = None
+
+
+def init_worker(context):
+    """Stores the `context` of the runs in a pool worker."""
+    global worker_context
+    worker_context = context
+
+
+def setup_worker_run(param_vals):
+    """Prepares a run in a pool worker, see `setup_run`."""
+    return setup_run(worker_context, param_vals)
+
+
+def write_script(fold_name, lines):
+    """Writes the execution script of `fold_name`."""
+    with open(fold_name + "execute", "w") as f:
+        f.write("".join(lines))
+    os.chmod(fold_name + "execute", 0o777)
 
-def input_line(val, comment, n_space=30):
-    value_str = " ".join(str(v) for v in val)
-    comment_str = " ; ".join(comment)
-    return "%-*s ! %s" % (n_space, value_str, comment_str)
 
+def write_batch(filename, lines):
+    """Writes the batch file `filename` in a single call."""
+    with open(filename, "w") as f:
+        f.write("".join(lines))
 
-def MSDOpen(filename, cached={}):
-    if filename in cached:
-        return cached[filename]
-    ds = MSD.Open(filename)
-    cached[filename] = ds
-    return ds
+
+def lazy_imap(pool, func, iterable, chunksize, max_pending):
+    """Ordered equivalent of `pool.imap` that reads `iterable` as it goes.
+
+    `pool.imap` queues its whole input up front. Here, at most `max_pending`
+    chunks of `chunksize` items are queued at once."""
+    items = iter(iterable)
+    pending = deque()
+    for chunk in iter(lambda: list(islice(items, chunksize)), []):
+        pending.append(pool.map_async(func, chunk, chunksize=len(chunk)))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().get()
+    while pending:
+        yield from pending.popleft().get()
+
+
+def preprocess_domain(fname, dataset=None):
+    """Writes the extract of a domain file around each observer in obs_data.
+
+    `dataset` is the content of `fname`, if already opened."""
+    if dataset is None:
+        dataset = MSD.Open(fname)
+
+    pad_bufs = dict()
+    for clipped in dataset.split_observers():
+        lat, lon = clipped.get_obs_pos()
+        lat, lon = lat[0], lon[0]
+
+        if "lumlp" in fname:
+            clipped.set_buffer(0)
+            clipped.set_overlap(0)
+        for i, dat in enumerate(clipped):
+            # Same shape, same window: the padding stays zero between reuses
+            if dat.shape not in pad_bufs:
+                pad = (512 - dat.shape[0]) // 2
+                pad_bufs[dat.shape] = (
+                    np.zeros(
+                        (dat.shape[0] + 2 * pad, dat.shape[1] + 2 * pad),
+                        dtype=np.float32,
+                    ),
+                    np.s_[pad : pad + dat.shape[0], pad : pad + dat.shape[1]],
+                )
+            padded_dat, window = pad_bufs[dat.shape]
+            padded_dat[window] = dat
+            save_bin(
+                "obs_data/%6f_%6f/%i/%s"
+                % (lat, lon, i, fname.rsplit(".", 1)[0] + ".bin"),
+                padded_dat,
+            )
+        if "srtm" in fname:
+            clipped.fill(0)
+            clipped.save(f"obs_data/{lat:6f}_{lon:6f}/blank")
 
 
 @click.command(name="batches")
@@ -91,47 +380,44 @@ def batches(
     os.chdir(input_path)
 
     with open("inputs_params.in") as f:
-        params = yaml.safe_load(f)
+        params = yaml.load(f, Loader=SafeLoader)
 
     if batch_name is not None:
         params["batch_file_name"] = batch_name
 
-    for fname in glob("%s*" % params["batch_file_name"]):
-        os.remove(fname)
+    batch_dir, batch_prefix = os.path.split(params["batch_file_name"])
+    with os.scandir(batch_dir or ".") as entries:
+        old_batches = [e.path for e in entries if e.name.startswith(batch_prefix)]
+    for old_batch in old_batches:
+        os.remove(old_batch)
 
     exp_name = params["exp_name"]
 
-    ds = MSD.Open(glob("*.hdf5")[0])
+    hdf_files = glob("*.hdf5")
+    ds = MSD.Open(hdf_files[0])
 
     # Pre process the obs extract
     print("Preprocessing...")
     shutil.rmtree("obs_data", True)
     lats, lons = ds.get_obs_pos()
-    xs, ys = ds.get_obs_pos(proj=True)
     for lat, lon in zip(lats, lons):
         for i in range(len(ds)):
             os.makedirs("obs_data/%6f_%6f/%d" % (lat, lon, i))
 
-    for i, fname in enumerate(progress(glob("*.hdf5")), 1):
-        dataset = MSD.Open(fname)
-        for clipped in dataset.split_observers():
-            lat, lon = clipped.get_obs_pos()
-            lat, lon = lat[0], lon[0]
-
-            if "lumlp" in fname:
-                clipped.set_buffer(0)
-                clipped.set_overlap(0)
-            for i, dat in enumerate(clipped):
-                padded_dat = np.pad(dat, (512 - dat.shape[0]) // 2, "constant")
-                save_bin(
-                    "obs_data/%6f_%6f/%i/%s"
-                    % (lat, lon, i, fname.rsplit(".", 1)[0] + ".bin"),
-                    padded_dat,
-                )
-            if "srtm" in fname:
-                for j in range(len(clipped)):
-                    clipped[j][:] = 0
-                clipped.save(f"obs_data/{lat:6f}_{lon:6f}/blank")
+    # Forked before any thread is started. The first file is already opened,
+    # so it is processed here meanwhile
+    with ExitStack() as stack:
+        n_workers = min(os.cpu_count(), len(hdf_files) - 1)
+        jobs = []
+        if n_workers:
+            pool = stack.enter_context(mp.get_context("fork").Pool(n_workers))
+            jobs = pool.imap_unordered(preprocess_domain, hdf_files[1:])
+        with ProgressBar(max_value=len(hdf_files), redirect_stdout=True) as bar:
+            bar.start()
+            preprocess_domain(hdf_files[0], ds)
+            bar.update(1)
+            for n, _ in enumerate(jobs, 2):
+                bar.update(n)
 
     # Add wavelength and multiscale
     spectral_bands = np.loadtxt("wav.lst", ndmin=2)
@@ -147,227 +433,133 @@ def batches(
             params[pname] = params[pname][0]
 
     with open("lamps.lst") as f:
-        lamps = f.read().split()
+        lamps = tuple(f.read().split())
 
+    # Reference direction of the azimuths, per observer
+    observers = list(zip(*ds.get_obs_pos()))
     if os.path.isfile("brng.lst"):
-        brng = np.loadtxt("brng.lst", ndmin=1)
+        bearings = dict(zip(observers, np.loadtxt("brng.lst", ndmin=1)))
+    else:
+        bearings = dict.fromkeys(observers, 0)
 
     # Clear and create execution folder
     dir_name = "exec" + os.sep
     shutil.rmtree(dir_name, True)
     os.makedirs(dir_name)
 
+    # Batch files are written as soon as they are full
+    batch_list = []
     count = 0
     multival = [k for k in params if isinstance(params[k], list)]
     multival = sorted(multival, key=len, reverse=True)  # Semi-arbitrary sort
     param_space = [params[k] for k in multival]
 
-    N = np.prod([len(p) for p in param_space])
-    for param_vals in progress(product(*param_space), max_value=N):
-        local_params = OrderedDict(zip(multival, param_vals))
-        P = ChainMap(local_params, params)
-        if (
-            "azimuth_angle" in multival
-            and P["elevation_angle"] == 90
-            and params["azimuth_angle"].index(P["azimuth_angle"]) != 0
-        ):
-            continue
-
-        if os.path.isfile("brng.lst"):
-            obs_index = (
-                0
-                if "observer_coordinates" not in multival
-                else params["observer_coordinates"].index(P["observer_coordinates"])
-            )
-            bearing = brng[obs_index]
-        else:
-            bearing = 0
-
-        coords = "%6f_%6f" % P["observer_coordinates"]
-        if "observer_coordinates" in multival:
-            P["observer_coordinates"] = coords
-
-        if compact:
-            fold_name = (
-                dir_name
-                + os.sep.join(
-                    f"{k}_{v}"
-                    for k, v in local_params.items()
-                    if k in ["observer_coordinates", "wavelength", "layer"]
-                )
-                + os.sep
-            )
-        else:
-            fold_name = (
-                dir_name
-                + os.sep.join(f"{k}_{v}" for k, v in local_params.items())
-                + os.sep
-            )
+    reflectances = dict(zip(wls, refls))
+    bandwidths = dict(zip(wls, spectral_bands[:, 1]))
+
+    context = dict(
+        params=params,
+        multival=multival,
+        compact=compact,
+        dir_name=dir_name,
+        lamps=lamps,
+        multi_obs="observer_coordinates" in multival,
+        bearings=bearings,
+        reflectances=reflectances,
+        bandwidths=bandwidths,
+        pixel_sizes=[ds.pixel_size(i) for i in range(len(ds))],
+    )
 
-        unique_ID = "-".join("%s_%s" % item for item in local_params.items())
-        wavelength = "%g" % P["wavelength"]
-        layer = P["layer"]
-        reflectance = refls[wls.index(P["wavelength"])]
-        bandwidth = spectral_bands[wls.index(P["wavelength"]), 1]
-
-        if not os.path.isdir(fold_name):
-            os.makedirs(fold_name)
-            # Linking files
-            mie_file = "{}_{}.txt".format(params["aerosol_profile"], wavelength)
-            os.symlink(os.path.relpath(mie_file, fold_name), fold_name + "aerosol.txt")
-            layer_file = "{}_{}.txt".format(params["layer_type"], wavelength)
-            os.symlink(os.path.relpath(layer_file, fold_name), fold_name + "layer.txt")
-
-            os.symlink(
-                os.path.relpath("MolecularAbs.txt", fold_name),
-                fold_name + "MolecularAbs.txt",
+    combinations = product(*param_space)
+    N = prod(len(p) for p in param_space)
+    if "azimuth_angle" in multival:
+        # All the azimuths are the same run at zenith, only the first is kept
+        i_az = multival.index("azimuth_angle")
+        first_az = params["azimuth_angle"][0]
+        n_az = len(params["azimuth_angle"])
+        n_dropped = n_az - params["azimuth_angle"].count(first_az)
+        if "elevation_angle" in multival:
+            i_el = multival.index("elevation_angle")
+            n_el = len(params["elevation_angle"])
+            n_zenith = params["elevation_angle"].count(90)
+            combinations = (
+                vals
+                for vals in combinations
+                if vals[i_el] != 90 or vals[i_az] == first_az
             )
-
-            for i, lamp in enumerate(lamps, 1):
-                os.symlink(
-                    os.path.relpath(
-                        f"fctem_wl_{wavelength}_lamp_{lamp}.dat",
-                        fold_name,
-                    ),
-                    fold_name + exp_name + "_fctem_%03d.dat" % i,
+            N -= N // (n_az * n_el) * n_zenith * n_dropped
+        elif params["elevation_angle"] == 90:
+            combinations = (vals for vals in combinations if vals[i_az] == first_az)
+            N -= N // n_az * n_dropped
+
+    with ExitStack() as stack:
+        if N < 500:
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=32))
+            runs = map(partial(setup_run, context), combinations)
+        else:
+            # Forked before the executor starts any thread. The workers get
+            # the context once, so only the parameter values are sent
+            pool = stack.enter_context(
+                mp.get_context("fork").Pool(
+                    os.cpu_count(), initializer=init_worker, initargs=(context,)
                 )
-
-            illumpath = os.path.dirname(illum.__path__[0])
-            os.symlink(
-                os.path.abspath(illumpath + "/bin/illumina"), fold_name + "illumina"
             )
-
-            # Copying layer data
-            obs_fold = os.path.join("obs_data", coords, str(layer))
-
-            os.symlink(
-                os.path.relpath(os.path.join(obs_fold, "srtm.bin"), fold_name),
-                fold_name + exp_name + "_topogra.bin",
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=32))
+            runs = lazy_imap(
+                pool,
+                setup_worker_run,
+                combinations,
+                chunksize=64,
+                max_pending=4 * os.cpu_count(),
             )
 
-            os.symlink(
-                os.path.relpath(os.path.join(obs_fold, "origin.bin"), fold_name),
-                fold_name + "origin.bin",
+        # In compact mode, the execution scripts are kept in memory and
+        # written once per folder. Otherwise each folder has a single run
+        # and its script is written right away
+        scripts = dict()
+        cwd = os.getcwd()
+        for fold_name, unique_ID in progress(runs, max_value=N):
+
+            # Write execute script
+            if fold_name not in scripts:
+                fold_path = os.path.join(cwd, fold_name.rstrip(os.sep))
+                scripts[fold_name] = [
+                    "#!/bin/sh\n"
+                    "#SBATCH --job-name=Illumina\n"
+                    "#SBATCH --time=%d:00:00\n"
+                    "#SBATCH --mem=2G\n"
+                    "cd %s\n"
+                    "umask 0011\n" % (params["estimated_computing_time"], fold_path)
+                ]
+
+                # Append execution to batch list
+                batch_list.append("cd %s\n%ssleep 0.05\n" % (fold_path, execute_str))
+                count += 1
+                if count % batch_size == 0:
+                    write_batch(
+                        f"{params['batch_file_name']}_{count // batch_size}",
+                        batch_list,
+                    )
+                    batch_list.clear()
+
+            # Add current parameters execution to execution script
+            scripts[fold_name].append(
+                f"cp {unique_ID}.in illumina.in\n"
+                "./illumina\n"
+                f"mv {exp_name}.out {exp_name}_{unique_ID}.out\n"
+                f"mv {exp_name}_pcl.bin {exp_name}_pcl_{unique_ID}.bin\n"
             )
+            if not compact:
+                write_script(fold_name, scripts.pop(fold_name))
 
-            for name in ["obstd", "obsth", "obstf", "altlp"]:
-                os.symlink(
-                    os.path.relpath(
-                        os.path.join(obs_fold, f"{exp_name}_{name}.bin"),
-                        fold_name,
-                    ),
-                    fold_name + f"{exp_name}_{name}.bin",
-                )
-
-            for i, lamp in enumerate(lamps, 1):
-                os.symlink(
-                    os.path.relpath(
-                        os.path.join(
-                            obs_fold,
-                            f"{exp_name}_{wavelength}_lumlp_{lamp}.bin",
-                        ),
-                        fold_name,
-                    ),
-                    fold_name + "%s_lumlp_%03d.bin" % (exp_name, i),
-                )
+        for _ in executor.map(write_script, scripts, scripts.values()):
+            pass
 
-        # Create illumina.in
-        input_data = (
-            (("", "Input file for ILLUMINA"),),
-            ((exp_name, "Root file name"),),
-            (
-                (ds.pixel_size(layer), "Cell size along X [m]"),
-                (ds.pixel_size(layer), "Cell size along Y [m]"),
-            ),
-            (("aerosol.txt", "Aerosol optical cross section file"),),
-            (
-                ("layer.txt", "Layer optical cross section file"),
-                (P["layer_aod"], "Layer aerosol optical depth at 500nm"),
-                (P["layer_alpha"], "Layer angstom coefficient"),
-                (P["layer_height"], "Layer scale height [m]"),
-            ),
-            ((P["double_scattering"] * 1, "Double scattering activated"),),
-            ((P["single_scattering"] * 1, "Single scattering activated"),),
-            ((wavelength, "Wavelength [nm]"), (bandwidth, "Bandwidth [nm]")),
-            ((reflectance, "Reflectance"),),
-            ((P["air_pressure"], "Ground level pressure [kPa]"),),
-            (
-                (P["aerosol_optical_depth"], "Aerosol optical depth at 500nm"),
-                (P["angstrom_coefficient"], "Angstrom exponent"),
-                (P["aerosol_height"], "Aerosol scale height [m]"),
-            ),
-            ((len(lamps), "Number of source types"),),
-            ((P["stop_limit"], "Contribution threshold"),),
-            (("", ""),),
-            (
-                (256, "Observer X position"),
-                (256, "Observer Y position"),
-                (P["observer_elevation"], "Observer elevation above ground [m]"),
-            ),
-            ((P["observer_obstacles"] * 1, "Obstacles around observer"),),
-            (
-                (P["elevation_angle"], "Elevation viewing angle"),
-                ((P["azimuth_angle"] + bearing) % 360, "Azimuthal viewing angle"),
-            ),
-            ((P["direct_fov"], "Direct field of view"),),
-            (("", ""),),
-            (("", ""),),
-            (("", ""),),
-            (
-                (
-                    P["reflection_radius"],
-                    "Radius around light sources where reflextions are computed",
-                ),
-            ),
-            (
-                (
-                    P["cloud_model"],
-                    "Cloud model: "
-                    "0=clear, "
-                    "1=Thin Cirrus/Cirrostratus, "
-                    "2=Thick Cirrus/Cirrostratus, "
-                    "3=Altostratus/Altocumulus, "
-                    "4=Cumulus/Cumulonimbus, "
-                    "5=Stratocumulus",
-                ),
-                (P["cloud_base"], "Cloud base altitude [m]"),
-                (P["cloud_fraction"], "Cloud fraction"),
-            ),
-            (("", ""),),
+    if batch_list:
+        write_batch(
+            f"{params['batch_file_name']}_{count // batch_size + 1}", batch_list
         )
 
-        with open(fold_name + unique_ID + ".in", "w") as f:
-            lines = (input_line(*zip(*line_data)) for line_data in input_data)
-            f.write("\n".join(lines))
-
-        # Write execute script
-        if not os.path.isfile(fold_name + "execute"):
-            with open(fold_name + "execute", "w") as f:
-                f.write("#!/bin/sh\n")
-                f.write("#SBATCH --job-name=Illumina\n")
-                f.write(
-                    "#SBATCH --time=%d:00:00\n" % params["estimated_computing_time"]
-                )
-                f.write("#SBATCH --mem=2G\n")
-                f.write("cd %s\n" % os.path.abspath(fold_name))
-                f.write("umask 0011\n")
-            os.chmod(fold_name + "execute", 0o777)
-
-            # Append execution to batch list
-            with open(f"{params['batch_file_name']}_{(count//batch_size)+1}", "a") as f:
-                f.write("cd %s\n" % os.path.abspath(fold_name))
-                f.write(execute_str)
-                f.write("sleep 0.05\n")
-
-            count += 1
-
-        # Add current parameters execution to execution script
-        with open(fold_name + "execute", "a") as f:
-            f.write("cp %s.in illumina.in\n" % unique_ID)
-            f.write("./illumina\n")
-            f.write(f"mv {exp_name}.out {exp_name}_{unique_ID}.out\n")
-            f.write(f"mv {exp_name}_pcl.bin {exp_name}_pcl_{unique_ID}.bin\n")
-
     print("Final count:", count)
 
     print("Done.")
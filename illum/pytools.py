@@ -207,18 +207,13 @@ def load_bin(filename, dtype=_np.float32):
 
 def save_bin(filename, data):
     """Saves a numpy data array as an ILLUMINA binary file."""
-    data = data.astype(_np.float32)
-    shape = data.shape[::-1]
-    size = data.size
-    data_flat = data.flatten()
-    filler = _np.ones(size, dtype=_np.float32) * 5.6e-45
+    data = _np.asarray(data, dtype=_np.float32)
+    head = _np.array((8,) + data.shape[::-1] + (8,), dtype=_np.uint32)
+    body = _np.full((data.size, 3), 5.6e-45, dtype=_np.float32)
+    body[:, 1] = data.ravel()
 
-    head = _np.array((8,) + shape + (8,)).astype(_np.uint32)
-    body = _np.array([filler, data_flat, filler]).T.flatten()
-
-    with open(filename, "w") as f:
+    with open(filename, "wb") as f:
         head.tofile(f)
-    with open(filename, "a") as f:
         body.tofile(f)
 
 